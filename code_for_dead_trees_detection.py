@@ -1,190 +1,248 @@
 
-import arcpy
-
-# Allow overwriting of existing output
-arcpy.env.overwriteOutput = True
-
-# Set the workspace
-arcpy.env.workspace = r"D:\Luba\chapter3\python_code_workflow"
-
-# Step 1: Iso Cluster tool with 10 classes on the resulting raster
+import glob
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+# Give GDAL a cache larger than one ortho tile (MB); the 5%-of-RAM default
+# falls back to an inefficient tile-by-tile path on these rasters.
+# Must be set before the first rasterio/arcpy raster operation.
+os.environ['GDAL_CACHEMAX'] = '4096'
 
-input_raster = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI\12_RISTAT033020OrthoSectorTile6.tif"
+import arcpy
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.features import shapes
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from scipy.ndimage import binary_closing, median_filter
+from shapely.geometry import shape
+from shapely.ops import unary_union
+
+# Optional GPU path: cuml.accel makes the unmodified sklearn KMeans below
+# dispatch to cuML on CUDA hosts; on machines without it we stay on CPU
+try:
+    import cuml
+    cuml.accel.install()
+except ImportError:
+    pass
+
+from sklearn.cluster import MiniBatchKMeans
+
+# rasterio and GeoPandas resolve relative names against the process CWD,
+# not arcpy.env.workspace, so every non-arcpy input and output is joined
+# to the workflow folder explicitly
+outdir = r"D:\Luba\chapter3\python_code_workflow"
+input_folder = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI"
 
 mask_layer = r"D:\Luba\chapter3\project_dead_trees_mapping\dead_trees_mapping\dead_trees_mapping.gdb\forest_from_ccap"
 #mask_layer = "shrubs_and_forest.tif"
-arcpy.env.cellSize = input_raster
-
-raster_clipped_forest = arcpy.sa.ExtractByMask(input_raster, mask_layer)
-raster_clipped_forest.save('aerial_image.tif')
-
-# Step 2: Iso Cluster tool with 10 classes on the resulting raster
-out_signature_file = "output_signature.GSG"
-arcpy.sa.IsoCluster(raster_clipped_forest, out_signature_file, number_classes=10)
-
-# Step 3: Maximum likelihood classification with the input signature file
-classified_raster = arcpy.sa.MLClassify('aerial_image.tif', out_signature_file)
-
-# Step 4: Reclassify the raster
-remap = arcpy.sa.RemapValue([[1, "NODATA"], [2, "NODATA"], [3, "NODATA"], [4, "NODATA"], [5, "NODATA"], [6, "NODATA"], [7, "NODATA"], [8, "NODATA"], [9, "NODATA"], [10, 1]])
-out_classified_raster = arcpy.sa.Reclassify(classified_raster, "Value", remap)
-out_classified_raster.save("dead_trees.tif")
-
-# # Step 5: Extract by red band:
-# red_raster='red_raster.tif'
-# arcpy.management.CreateColorComposite(input_raster, red_raster, 'Band IDs', 'B1', 'B1', 'B1')
-#
-# remap = "0 100 NODATA; 100 255 1"
-# out_raster='red_mask.tif'
-# arcpy.ddd.Reclassify(red_raster, 'Value', remap, out_raster, 'True')
-#
-# extracted_raster_by_red = arcpy.sa.ExtractByMask("dead_trees.tif", 'red_mask.tif')
-# extracted_raster_by_red.save('extracted_raster_by_red.tif')
-
-
-# Step 6: Extract by blue band
-arcpy.management.CreateColorComposite(input_raster, 'blue_raster.tif', 'Band IDs', 'B3', 'B3', 'B3')
-
-remap = "29 150 NODATA; 150 250 1"
-out_raster='blue_mask.tif'
-arcpy.ddd.Reclassify('blue_raster.tif', 'Value', remap, out_raster, 'True')
-extracted_raster_both_bands = arcpy.sa.ExtractByMask('dead_trees.tif', 'blue_mask.tif')
-extracted_raster_both_bands.save("extracted_raster_one_band.tif")
-
-(arcpy.sa.MajorityFilter("extracted_raster_one_band.tif")).save("filtered_raster.tif")
-
-
-# Step 7a Expand on 1 pixel to connect tree's fragments
-(arcpy.sa.Expand("filtered_raster.tif", 1, 1)).save("expanded_raster.tif")
-
-# Step 7b Shrink on 1 pixel to connect tree's fragments
-(arcpy.sa.Shrink("expanded_raster.tif", 1, 1)).save("shrinked_raster.tif")
-
-# Step 7: Convert to a vector layer and filter by size
-dead_trees_region = arcpy.sa.RegionGroup("shrinked_raster.tif")
-
-arcpy.conversion.RasterToPolygon(dead_trees_region, "dead_trees_vector.shp", "NO_SIMPLIFY")
-
-# Add a new field named "Shape_Area" to store the area
-arcpy.AddField_management("dead_trees_vector.shp", "Shape_Area", "DOUBLE")
-
-# Calculate the area and populate the "Shape_Area" field
-expression = "!shape.area!"
-arcpy.CalculateField_management("dead_trees_vector.shp", "Shape_Area", expression, "PYTHON")
-
-in_feature = "dead_trees_vector.shp"
-out_feature = "dead_trees_selected.shp"
-where_clause = "Shape_Area > 2"
-arcpy.analysis.Select("dead_trees_vector.shp", out_feature, where_clause)
-
-arcpy.management.CopyFeatures("dead_trees_selected.shp", 'dead_trees_selected_copy.shp')
-
-
-# Step 8: Buffer dead trees, dissolve and filter by size:
-in_features = 'dead_trees_selected_copy.shp'
-out_feature_class = 'buffered_trees.shp'
-buffer_distance_or_field = "1 Meters"  # Change the buffer distance as needed
-line_side = "FULL"
-line_end_type = "ROUND"
-# Perform the buffer analysis
-arcpy.analysis.Buffer(in_features, out_feature_class, buffer_distance_or_field, line_side, line_end_type)
-
-in_buffer = 'buffered_trees.shp'
-dissolved = 'dissolved_buffer.shp'
-arcpy.management.Dissolve(in_buffer, dissolved, "", "", "SINGLE_PART")
-
-# Add a new field named "Shape_Area" to store the area
-arcpy.AddField_management("dissolved_buffer.shp", "Shape_Area", "DOUBLE")
-
-# Calculate the area and populate the "Shape_Area" field
-expression = "!shape.area!"
-arcpy.CalculateField_management("dissolved_buffer.shp", "Shape_Area", expression, "PYTHON")
-
-out_feature = "trees_buffer_processed.shp"
-where_clause = '"Shape_Area">80'
-arcpy.analysis.Select("dissolved_buffer.shp", out_feature, where_clause)
-
-in_rast = "trees_buffer_processed.shp"
-out_rast = "dead_trees_final_12.shp"
-arcpy.management.CopyFeatures(in_rast, out_rast)
-
-
-# Step 9: Spacial join tables:
-
-input_Molly_points = "Molly_deadtrees.shp"
-extent_layer = "aerial_image.tif"
-arcpy.env.extent = extent_layer
-output_clipped = "Molly_points_clipped.shp"
-output_clipped = arcpy.management.CopyFeatures(input_Molly_points, output_clipped)
-
-target_feature = "dead_trees_final.shp"
-join_feature = "Molly_points_clipped.shp"
-out_feature_class = "polygons_to_points.shp"
-arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
-
-target_feature = "Molly_points_clipped.shp"
-join_feature = "dead_trees_final.shp"
-out_feature_class = "points_to_polygons.shp"
-arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
-
-#Calculate number rows which had intersection with ground data
-
-# Specify the input feature classes
-polygons_to_points = "polygons_to_points.shp"
-points_to_polygons = "points_to_polygons.shp"
-
-
-# Use the Select tool to select rows where Join_Count is not equal to 0 for polygons_to_points
-arcpy.Select_analysis(polygons_to_points, "selected_polygons_to_points", '"Join_Count" <> 0')
-
-# Use the Get Count tool to count selected features and total features for polygons_to_points
-TP = int(arcpy.GetCount_management("selected_polygons_to_points").getOutput(0))
-All_polygons = int(arcpy.GetCount_management(polygons_to_points).getOutput(0))
-FN = All_polygons - TP
-
-
-# Use the Select tool to select rows where Join_Count is not equal to 0 for points_to_polygons
-arcpy.Select_analysis(points_to_polygons, "selected_points_to_polygons", '"Join_Count" <> 0')
-
-# Use the Get Count tool to count selected features and total features for points_to_polygons
-TP_2 = int(arcpy.GetCount_management("selected_points_to_polygons").getOutput(0))
-All_points = int(arcpy.GetCount_management(points_to_polygons).getOutput(0))
-FP = All_points - TP_2
-
-# Print number of intersecting rows
-print(f"Polygons which had intersecting point: {TP:.2f}")
-print(f"Polygons which did not had intersecting point: {FN:.2f}")
-print(f"All polygons: {All_polygons:.2f}")
-print(f"Points which had intersecting polygons: {TP_2:.2f}")
-print(f"Points which did not had intersecting polygons: {FP:.2f}")
-print(f"All points: {All_points:.2f}")
-
-# Calculate Precision
-precision = TP / (TP + FP)
-
-# Calculate Recall
-recall = TP / (TP + FN)
-
-# Calculate F1-score
-f1_score = 2 * (precision * recall) / (precision + recall)
-
-# Print the results
-print(f"Precision: {precision:.2f}")
-print(f"Recall: {recall:.2f}")
-print(f"F1-score: {f1_score:.2f}")
-
-## Calculate this with TP_2 in place of TP:
-
-# Calculate Precision
-precision_2 = TP_2 / (TP_2 + FP)
-
-# Calculate Recall
-recall_2 = TP_2 / (TP_2 + FN)
-
-# Calculate F1-score
-f1_score_2 = 2 * (precision_2 * recall_2) / (precision_2 + recall_2)
 
-# Print the results
-print(f"Precision with inverted spatial join: {precision_2:.2f}")
-print(f"Recall with inverted spatial join: {recall_2:.2f}")
-print(f"F1-score with inverted spatial join: {f1_score_2:.2f}")
\ No newline at end of file
+input_Molly_points = os.path.join(outdir, "Molly_deadtrees.shp")
+
+# 3x3 median (radius 1) + 3x3 closing (dilate then erode, radius 2):
+# an output pixel depends on source pixels up to 3 away
+HALO = 3
+
+
+def save_raster(path, array, transform, crs):
+    # Tiled + LZW GeoTIFF: ~3x fewer bytes than arcpy's striped,
+    # uncompressed .save() output, and block-aligned for later reads
+    bands = array if array.ndim == 3 else array[np.newaxis, :, :]
+    with rasterio.open(path, "w", driver="GTiff",
+                       height=bands.shape[1], width=bands.shape[2],
+                       count=bands.shape[0], dtype=bands.dtype,
+                       crs=crs, transform=transform,
+                       tiled=True, blockxsize=512, blockysize=512,
+                       compress="LZW", predictor=2) as dst:
+        dst.write(bands)
+
+
+def process_tile(input_raster):
+    # The tiles are independent, so the whole pipeline runs once per tile
+    # inside a worker process; each worker gets a private scratch workspace
+    # so the arcpy steps do not contend with the other workers
+    tile_name = os.path.splitext(os.path.basename(input_raster))[0]
+
+    arcpy.env.overwriteOutput = True
+    # Let the arcpy tools that support it (ExtractByMask here) use all cores
+    arcpy.env.parallelProcessingFactor = "100%"
+    arcpy.env.workspace = outdir
+    arcpy.env.scratchWorkspace = tempfile.mkdtemp()
+    arcpy.env.cellSize = input_raster
+
+    # Step 1: Clip the aerial image to the forest mask
+    raster_clipped_forest = arcpy.sa.ExtractByMask(input_raster, mask_layer)
+
+    with rasterio.open(input_raster) as src:
+        crs = src.crs
+
+    # Steps 2-4: Cluster the masked pixels in memory with MiniBatchKMeans
+    # (replaces IsoCluster + MLClassify + Reclassify, so the raster is read
+    # once and no signature file is written to disk)
+    pixels = arcpy.RasterToNumPyArray(raster_clipped_forest, nodata_to_value=0)
+    n_bands, height, width = pixels.shape
+
+    # The band thresholds used below are 8-bit ranges, so the imagery is
+    # effectively uint8 — quantize before clustering: half the bytes streamed
+    # through KMeans, and sklearn upcasts uint8 to float32 instead of float64
+    pixel_vectors = pixels.astype(np.uint8, copy=False).reshape(n_bands, -1).T
+
+    cell_size = raster_clipped_forest.meanCellWidth
+    transform = from_origin(raster_clipped_forest.extent.XMin, raster_clipped_forest.extent.YMax, cell_size, cell_size)
+    save_raster(os.path.join(outdir, f'aerial_image_{tile_name}.tif'), pixels, transform, crs)
+
+    # Drop nodata pixels so they do not pull the cluster centers
+    valid = pixel_vectors.any(axis=1)
+
+    kmeans = MiniBatchKMeans(n_clusters=10, batch_size=8192, n_init=3)
+    labels = kmeans.fit_predict(pixel_vectors[valid])
+
+    # Dead crowns are the brightest pixels in summer imagery, so keep the
+    # cluster with the brightest center (same role as class 10 in the
+    # IsoCluster version)
+    dead_class = np.argmax(kmeans.cluster_centers_.sum(axis=1))
+
+    dead_trees = np.zeros(height * width, dtype=np.uint8)
+    dead_trees[valid] = (labels == dead_class).astype(np.uint8)
+    dead_trees = dead_trees.reshape(height, width)
+
+    save_raster(os.path.join(outdir, f"dead_trees_{tile_name}.tif"), dead_trees, transform, crs)
+
+    # Step 6 + 7a/7b: blue-band threshold, majority filter and binary closing,
+    # computed per 512x512 window and dispatched to a thread pool. NumPy/SciPy
+    # release the GIL, so the tiles run on all cores while the windowed reads
+    # overlap the compute, and only one window of band 3 is resident at a time.
+    mask = np.zeros((height, width), dtype=np.uint8)
+    b3_src = rasterio.open(input_raster)
+    # The masked grid starts at the raster/mask intersection, not at the
+    # source raster origin, so band-3 windows are shifted by the offset
+    # between the two transforms before reading from the unmasked source
+    col_shift = int(round((transform.c - b3_src.transform.c) / cell_size))
+    row_shift = int(round((b3_src.transform.f - transform.f) / cell_size))
+    read_lock = threading.Lock()
+
+    def clean_window(window):
+        # Grow the window by the halo (clipped to the raster) so the filters
+        # see their full neighborhood at tile edges
+        row_off = max(window.row_off - HALO, 0)
+        col_off = max(window.col_off - HALO, 0)
+        row_end = min(window.row_off + window.height + HALO, height)
+        col_end = min(window.col_off + window.width + HALO, width)
+        with read_lock:
+            b3 = b3_src.read(3, window=Window(col_off + col_shift, row_off + row_shift,
+                                              col_end - col_off, row_end - row_off))
+        tile = ((b3 >= 150) & (b3 < 250)) & (dead_trees[row_off:row_end, col_off:col_end] == 1)
+        tile = median_filter(tile.astype(np.uint8), size=3)
+        tile = binary_closing(tile, structure=np.ones((3, 3), bool)).astype(np.uint8)
+        # Trim the halo back off
+        r0 = window.row_off - row_off
+        c0 = window.col_off - col_off
+        return window, tile[r0:r0 + window.height, c0:c0 + window.width]
+
+    windows = [Window(c, r, min(512, width - c), min(512, height - r))
+               for r in range(0, height, 512) for c in range(0, width, 512)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for window, tile in pool.map(clean_window, windows):
+            mask[window.row_off:window.row_off + window.height,
+                 window.col_off:window.col_off + window.width] = tile
+    b3_src.close()
+
+    save_raster(os.path.join(outdir, f"filtered_raster_{tile_name}.tif"), mask, transform, crs)
+
+    # Step 7: Convert to a vector layer and filter by size, in process
+    # (rasterio.features.shapes yields each connected region straight from the
+    # mask array — no RegionGroup, no dead_trees_vector.shp round-trip)
+    geoms = [shape(geom) for geom, value in shapes(mask, mask=mask.astype(bool), transform=transform) if value == 1]
+    dead_trees_selected = gpd.GeoDataFrame(geometry=geoms, crs=crs)
+    dead_trees_selected = dead_trees_selected[dead_trees_selected.geometry.area > 2]
+    dead_trees_selected.to_file(os.path.join(outdir, f"dead_trees_selected_{tile_name}.shp"))
+
+    # Step 8: Buffer dead trees, dissolve and filter by size in one shapely
+    # pass (unary_union of the 1 m buffers is the SINGLE_PART dissolve; no
+    # buffered_trees.shp / dissolved_buffer.shp / trees_buffer_processed.shp)
+    merged = gpd.GeoSeries([unary_union(dead_trees_selected.geometry.buffer(1))],
+                           crs=dead_trees_selected.crs).explode(index_parts=False)
+    merged = merged[merged.area > 80]
+    polygons = gpd.GeoDataFrame(geometry=merged)
+    polygons.to_file(os.path.join(outdir, f"dead_trees_final_{tile_name}.shp"))
+
+    # Step 9: Spatial join through the GeoPandas R-tree index
+    # (exact point-in-polygon with an MBR prefilter, no pixel quantization)
+    points = gpd.read_file(input_Molly_points)
+
+    # Keep only the points falling on the tile (same role as the extent clip)
+    extent = raster_clipped_forest.extent
+    points = points.cx[extent.XMin:extent.XMax, extent.YMin:extent.YMax]
+
+    All_polygons = len(polygons)
+    All_points = len(points)
+
+    try:
+        import cuspatial
+
+        # GPU point-in-polygon: all points are tested against all polygons in
+        # parallel on device, and the TP reductions stay on the GPU too
+        gpu_points = cuspatial.GeoSeries.from_geopandas(points.geometry)
+        gpu_polygons = cuspatial.GeoSeries.from_geopandas(polygons.geometry)
+        hits = cuspatial.point_in_polygon(gpu_points, gpu_polygons)
+        TP = int(hits.any(axis=0).sum())
+        TP_2 = int(hits.any(axis=1).sum())
+    except ImportError:
+        # CPU fallback: R-tree join through GeoPandas
+        joined_points = gpd.sjoin(points, polygons, predicate="intersects", how="left")
+        joined_polygons = gpd.sjoin(polygons, points, predicate="intersects", how="left")
+        TP = int(joined_polygons.loc[joined_polygons["index_right"].notna()].index.nunique())
+        TP_2 = int(joined_points["index_right"].notna().sum())
+
+    FN = All_polygons - TP
+    FP = All_points - TP_2
+
+    # Print number of intersecting rows
+    print(f"Image Label: {tile_name}")
+    print(f"Polygons which had intersecting point: {TP:.2f}")
+    print(f"Polygons which did not had intersecting point: {FN:.2f}")
+    print(f"All polygons: {All_polygons:.2f}")
+    print(f"Points which had intersecting polygons: {TP_2:.2f}")
+    print(f"Points which did not had intersecting polygons: {FP:.2f}")
+    print(f"All points: {All_points:.2f}")
+
+    # Calculate Precision
+    precision = TP / (TP + FP)
+
+    # Calculate Recall
+    recall = TP / (TP + FN)
+
+    # Calculate F1-score
+    f1_score = 2 * (precision * recall) / (precision + recall)
+
+    # Print the results
+    print(f"Precision: {precision:.2f}")
+    print(f"Recall: {recall:.2f}")
+    print(f"F1-score: {f1_score:.2f}")
+
+    ## Calculate this with TP_2 in place of TP:
+
+    # Calculate Precision
+    precision_2 = TP_2 / (TP_2 + FP)
+
+    # Calculate Recall
+    recall_2 = TP_2 / (TP_2 + FN)
+
+    # Calculate F1-score
+    f1_score_2 = 2 * (precision_2 * recall_2) / (precision_2 + recall_2)
+
+    # Print the results
+    print(f"Precision with inverted spatial join: {precision_2:.2f}")
+    print(f"Recall with inverted spatial join: {recall_2:.2f}")
+    print(f"F1-score with inverted spatial join: {f1_score_2:.2f}")
+
+
+if __name__ == "__main__":
+    # The tiles are independent, so fan the batch out over worker processes
+    tiles = glob.glob(os.path.join(input_folder, "*.tif"))
+    with Pool(processes=min(8, len(tiles))) as pool:
+        pool.map(process_tile, tiles)
@@ -47,49 +47,52 @@ extracted_raster_both_bands.save("extracted_raster_one_band.tif")
 (arcpy.sa.Shrink("expanded_raster.tif", 1, 1)).save("shrinked_raster.tif")
 
 # Step 7: Convert to a vector layer and filter by size
+# Intermediate feature classes live in the arcpy memory workspace from here
+# on, so Select/Buffer/Dissolve never serialize .shp/.shx/.dbf to disk;
+# only the final and reported outputs are written as shapefiles
 dead_trees_region = arcpy.sa.RegionGroup("shrinked_raster.tif")
-arcpy.conversion.RasterToPolygon(dead_trees_region, "dead_trees_vector.shp", "NO_SIMPLIFY")
+arcpy.conversion.RasterToPolygon(dead_trees_region, r"memory\dead_trees_vector", "NO_SIMPLIFY")
 
 # Add a new field named "Shape_Area" to store the area
-arcpy.AddField_management("dead_trees_vector.shp", "Shape_Area", "DOUBLE")
+arcpy.AddField_management(r"memory\dead_trees_vector", "Shape_Area", "DOUBLE")
 
 # Calculate the area and populate the "Shape_Area" field
 expression = "!shape.area!"
-arcpy.CalculateField_management("dead_trees_vector.shp", "Shape_Area", expression, "PYTHON")
+arcpy.CalculateField_management(r"memory\dead_trees_vector", "Shape_Area", expression, "PYTHON")
 #
-in_feature = "dead_trees_vector.shp"
-out_feature = "dead_trees_selected.shp"
+in_feature = r"memory\dead_trees_vector"
+out_feature = r"memory\dead_trees_selected"
 where_clause = "Shape_Area > 2"
-arcpy.analysis.Select("dead_trees_vector.shp", out_feature, where_clause)
+arcpy.analysis.Select(r"memory\dead_trees_vector", out_feature, where_clause)
 
-arcpy.management.CopyFeatures("dead_trees_selected.shp", 'dead_trees_selected_copy.shp')
+arcpy.management.CopyFeatures(r"memory\dead_trees_selected", r"memory\dead_trees_selected_copy")
 
 
 # Step 8: Buffer dead trees, dissolve and filter by size:
-in_features = 'dead_trees_selected_copy.shp'
-out_feature_class = 'buffered_trees.shp'
+in_features = r"memory\dead_trees_selected_copy"
+out_feature_class = r"memory\buffered_trees"
 buffer_distance_or_field = "1 Meters"  # Change the buffer distance as needed
 line_side = "FULL"
 line_end_type = "ROUND"
 # Perform the buffer analysis
 arcpy.analysis.Buffer(in_features, out_feature_class, buffer_distance_or_field, line_side, line_end_type)
 
-in_buffer = 'buffered_trees.shp'
-dissolved = 'dissolved_buffer.shp'
+in_buffer = r"memory\buffered_trees"
+dissolved = r"memory\dissolved_buffer"
 arcpy.management.Dissolve(in_buffer, dissolved, "", "", "SINGLE_PART")
 
 # Add a new field named "Shape_Area" to store the area
-arcpy.AddField_management("dissolved_buffer.shp", "Shape_Area", "DOUBLE")
+arcpy.AddField_management(r"memory\dissolved_buffer", "Shape_Area", "DOUBLE")
 
 # Calculate the area and populate the "Shape_Area" field
 expression = "!shape.area!"
-arcpy.CalculateField_management("dissolved_buffer.shp", "Shape_Area", expression, "PYTHON")
+arcpy.CalculateField_management(r"memory\dissolved_buffer", "Shape_Area", expression, "PYTHON")
 
-out_feature = "trees_buffer_processed.shp"
+out_feature = r"memory\trees_buffer_processed"
 where_clause = '"Shape_Area">80'
-arcpy.analysis.Select("dissolved_buffer.shp", out_feature, where_clause)
+arcpy.analysis.Select(r"memory\dissolved_buffer", out_feature, where_clause)
 
-in_rast = "trees_buffer_processed.shp"
+in_rast = r"memory\trees_buffer_processed"
 out_rast = "dead_trees_final.shp"
 arcpy.management.CopyFeatures(in_rast, out_rast)
 
@@ -101,40 +104,47 @@ clipping = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI\buffer
 arcpy.analysis.Clip(input_points, clipping, "dead_trees_final_clip_12.shp")
 
 
+# The join outputs exist only to be counted, so they go to the memory
+# workspace and are dropped right after — no shapefiles hit the disk
 target_feature = "dead_trees_final_clip_12.shp"
 join_feature = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI\marked_tree_12.shp"
-out_feature_class = "polygons_to_points.shp"
-arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
+out_feature_class = r"memory\polygons_to_points"
+arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class, match_option="INTERSECT")
 
 target_feature = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI\marked_tree_12.shp"
 join_feature = "dead_trees_final_clip_12.shp"
-out_feature_class = "points_to_polygons.shp"
-arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
+out_feature_class = r"memory\points_to_polygons"
+arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class, match_option="INTERSECT")
 
 #Calculate number rows which had intersection with ground data
 
 # Specify the input feature classes
-polygons_to_points = "polygons_to_points.shp"
-points_to_polygons = "points_to_polygons.shp"
+polygons_to_points = r"memory\polygons_to_points"
+points_to_polygons = r"memory\points_to_polygons"
 
 
-# Use the Select tool to select rows where Join_Count is not equal to 0 for polygons_to_points
-arcpy.Select_analysis(polygons_to_points, "selected_polygons_to_points", '"Join_Count" <> 0')
-
-# Use the Get Count tool to count selected features and total features for polygons_to_points
-TP = int(arcpy.GetCount_management("selected_polygons_to_points").getOutput(0))
-All_polygons = int(arcpy.GetCount_management(polygons_to_points).getOutput(0))
-FN = All_polygons - TP
+# One C-backed cursor pass per feature class counts the matches and the
+# total together — no selection feature class to materialize and no
+# GetCount tool round-trips
+def count_join(fc):
+    total = tp = 0
+    with arcpy.da.SearchCursor(fc, ["Join_Count"]) as cur:
+        for (jc,) in cur:
+            total += 1
+            if jc:
+                tp += 1
+    return tp, total
 
 
-# Use the Select tool to select rows where Join_Count is not equal to 0 for points_to_polygons
-arcpy.Select_analysis(points_to_polygons, "selected_points_to_polygons", '"Join_Count" <> 0')
+TP, All_polygons = count_join(polygons_to_points)
+FN = All_polygons - TP
 
-# Use the Get Count tool to count selected features and total features for points_to_polygons
-TP_2 = int(arcpy.GetCount_management("selected_points_to_polygons").getOutput(0))
-All_points = int(arcpy.GetCount_management(points_to_polygons).getOutput(0))
+TP_2, All_points = count_join(points_to_polygons)
 FP = All_points - TP_2
 
+arcpy.Delete_management(polygons_to_points)
+arcpy.Delete_management(points_to_polygons)
+
 # Print number of intersecting rows
 print(f"Polygons which had intersecting point: {TP:.2f}")
 print(f"Polygons which did not had intersecting point: {FN:.2f}")
